@@ -0,0 +1,51 @@
+""" Times the expansion of a series: the former relativedelta stepping loop against
+the closed form of `RepeatableEvent`.
+
+Usage: python benchmark.py [years]
+"""
+import sys
+from time import perf_counter
+from datetime import datetime, timedelta
+from dateutil.relativedelta import relativedelta
+
+from calendar_lib import RepeatableEvent
+
+def steppingDates(start, stop, until, repeat_every):
+    """ Occurrences as the former RepeatableEvent.datesGenerator produced them. """
+    hours = days = weeks = months = 0
+    if repeat_every == "Hour": hours = 1
+    elif repeat_every == "Day": days = 1
+    elif repeat_every == "Week": weeks = 1
+    else: months = 1
+    step = relativedelta(months = months, weeks = weeks, days = days, hours = hours)
+    dates = []
+    while stop.date() <= until:
+        dates.append((start, stop))
+        start += step
+        stop += step
+    return dates
+
+def timeit(function):
+    begin = perf_counter()
+    result = function()
+    return result, perf_counter() - begin
+
+if __name__ == "__main__":
+    years = 10
+    if len(sys.argv) > 1:
+        years = int(sys.argv[1])
+    start = datetime(2026, 1, 1, 10)
+    stop = start + timedelta(minutes = 30)
+    until = start.date() + timedelta(days = 365 * years)
+    series = RepeatableEvent(start, stop, until, "Hour")
+
+    old, old_time = timeit(lambda: steppingDates(start, stop, until, "Hour"))
+    new, new_time = timeit(lambda: list(series.datesGenerator()))
+    count, count_time = timeit(series.countOccurrences)
+    if (old != new) or (count != len(new)):
+        raise(SystemError("Closed form and stepping loop disagree."))
+
+    print("%d-year hourly series, %d occurrences"%(years, count))
+    print("relativedelta stepping loop: %.3f s"%old_time)
+    print("closed-form expansion:       %.3f s"%new_time)
+    print("countOccurrences:            %.1f us"%(count_time * 1e6))
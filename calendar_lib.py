@@ -0,0 +1,606 @@
+from math import gcd
+from heapq import merge
+from array import array
+from itertools import repeat
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, time
+from dateutil.relativedelta import relativedelta
+
+import cons
+
+EPOCH = datetime(1970, 1, 1)
+EPOCH_DAY = EPOCH.toordinal()
+DAY_MINUTES = 60 * 24
+MINUTE = timedelta(minutes = 1)
+FORMAT_VERSION = 2
+
+def toMinutes(date):
+    """ Whole minutes elapsed since `EPOCH`. """
+    return (date - EPOCH) // timedelta(minutes = 1)
+
+def fromMinutes(minutes):
+    return EPOCH + timedelta(minutes = minutes)
+
+CLOCK = ["%02d-%02d"%divmod(minute, 60) for minute in range(DAY_MINUTES)]
+
+def formatLines(starts, stops):
+    """ Formats rows of minutes since `EPOCH` as the text of schedule.dat.
+
+    The output is the same as joining `Event.save` for every row, but each date is
+    formatted once per day and the time of day comes from the precomputed `CLOCK`.
+    """
+    days = {}
+    lines = []
+    for start, stop in zip(starts, stops):
+        start_day, start_minute = divmod(start, DAY_MINUTES)
+        stop_day, stop_minute = divmod(stop, DAY_MINUTES)
+        try:
+            start_date = days[start_day]
+        except KeyError:
+            start_date = days[start_day] = fromMinutes(start_day * DAY_MINUTES).strftime("%d-%m-%y-")
+        try:
+            stop_date = days[stop_day]
+        except KeyError:
+            stop_date = days[stop_day] = fromMinutes(stop_day * DAY_MINUTES).strftime("%d-%m-%y-")
+        lines.append(start_date + CLOCK[start_minute] + "; " + stop_date + CLOCK[stop_minute] + "\n")
+    return "".join(lines)
+
+class Event(object):
+    def __init__(self, start, stop, parent = None):
+        self.start = start.replace(second = 0, microsecond = 0)
+        self.stop = stop.replace(second = 0, microsecond = 0)
+        self.parent = parent
+
+    def setStart(self, start):
+        self.start = start
+
+    def setStop(self, stop):
+        self.stop = stop
+
+    def getDate(self):
+        return self.start.date()
+
+    def getStart(self):
+        return self.start
+
+    def getStop(self):
+        return self.stop
+
+    def isChild(self):
+        if self.parent == None:
+            return False
+        else:
+            return True
+
+    def getParent(self):
+        return self.parent
+
+    def save(self):
+        start = self.start.strftime("%d-%m-%y-%H-%M")
+        stop = self.stop.strftime("%d-%m-%y-%H-%M")
+        txt = "%s; %s\n"%(start, stop)
+        return txt
+
+    def viewRepresentation(self):
+        start = self.start.strftime("%Y/%m/%d %H:%M")
+        stop = self.stop.strftime("%Y/%m/%d %H:%M")
+        txt = "%s - %s"%(start, stop)
+        return txt
+
+    def __str__(self):
+        start = self.start.strftime("%H:%M")
+        stop = self.stop.strftime("%H:%M")
+        return "%s - %s"%(start, stop)
+
+class RepeatableEvent(object):
+    def __init__(self, start, stop, until, repeat_every, exceptions = ()):
+        self.until = until
+        self.every = repeat_every
+        self.start = start.replace(second = 0, microsecond = 0)
+        self.stop = stop.replace(second = 0, microsecond = 0)
+        self.exceptions = set(exceptions)
+
+    def getPeriod(self):
+        """ Returns the fixed repeat period as a timedelta, None for monthly repeats. """
+        try:
+            return timedelta(minutes = cons.REPEAT_MINUTES[self.every])
+        except KeyError:
+            return None
+
+    def getOccurrence(self, n):
+        """ Returns the (start, stop) pair of the `n`-th occurrence, counted from zero.
+        Only the start is anchored to the calendar: monthly starts are clamped to the end
+        of shorter months and every occurrence keeps the duration of the first one.
+        """
+        period = self.getPeriod()
+        if period == None:
+            start = self.start + relativedelta(months = n)
+        else:
+            start = self.start + n * period
+        return (start, start + (self.stop - self.start))
+
+    def getIndex(self, start):
+        """ Returns the number of the occurrence starting at `start`, None if there is none. """
+        period = self.getPeriod()
+        if period == None:
+            n = 12 * (start.year - self.start.year) + start.month - self.start.month
+        else:
+            n = (start - self.start) // period
+        if (n >= 0) and (self.getOccurrence(n)[0] == start):
+            return n
+        return None
+
+    def countOccurrences(self):
+        """ Number of occurrences stopping on or before `until`, computed without enumerating them. """
+        limit = datetime.combine(self.until, time()) + timedelta(days = 1)
+        period = self.getPeriod()
+        if period == None:
+            n = 12 * (self.until.year - self.start.year) + self.until.month - self.start.month
+            while (n >= 0) and (self.getOccurrence(n)[1] >= limit):
+                n -= 1
+            return n + 1
+        return max(0, -((self.stop - limit) // period))
+
+    def indexRange(self, begin = None, end = None):
+        """ Range of the occurrence numbers that overlap [`begin`, `end`). """
+        count = self.countOccurrences()
+        first = 0
+        last = count
+        period = self.getPeriod()
+        if period == None:
+            if begin != None:
+                earliest = begin - (self.stop - self.start)
+                first = max(0, 12 * (earliest.year - self.start.year) + earliest.month - self.start.month)
+                while (first < count) and (self.getOccurrence(first)[1] <= begin):
+                    first += 1
+            if end != None:
+                last = first
+                while (last < count) and (self.getOccurrence(last)[0] < end):
+                    last += 1
+        else:
+            if begin != None:
+                first = max(first, (begin - self.stop) // period + 1)
+            if end != None:
+                last = min(last, -((self.start - end) // period))
+        return range(first, max(first, last))
+
+    def datesGenerator(self, begin = None, end = None):
+        """ Lazily yields the (start, stop) pairs of the series.
+        Args:
+            begin (datetime): only occurrences stopping after `begin` are yielded.
+            end (datetime): only occurrences starting before `end` are yielded.
+        """
+        period = self.getPeriod()
+        exceptions = self.exceptions
+        if period == None:
+            for n in self.indexRange(begin, end):
+                if n not in exceptions:
+                    yield self.getOccurrence(n)
+        else:
+            start = self.start
+            stop = self.stop
+            for n in self.indexRange(begin, end):
+                if n not in exceptions:
+                    delta = n * period
+                    yield (start + delta, stop + delta)
+
+    def getStart(self):
+        return self.start
+
+    def getStop(self):
+        return self.stop
+
+    def getUntil(self):
+        return self.until
+
+    def getRepeat(self):
+        return self.every
+
+    def getExceptions(self):
+        return self.exceptions
+
+    def getRule(self):
+        return (self.start, self.stop, self.until, self.every, sorted(self.exceptions))
+
+    def getMinutes(self):
+        """ Returns the starts and stops of every occurrence as minutes since `EPOCH`. """
+        count = self.countOccurrences()
+        try:
+            period = cons.REPEAT_MINUTES[self.every]
+        except KeyError:
+            dates = list(self.datesGenerator())
+            return [toMinutes(date[0]) for date in dates], [toMinutes(date[1]) for date in dates]
+        start = toMinutes(self.start)
+        stop = toMinutes(self.stop)
+        starts = range(start, start + count * period, period)
+        stops = range(stop, stop + count * period, period)
+        if len(self.exceptions):
+            numbers = [n for n in range(count) if n not in self.exceptions]
+            return [starts[n] for n in numbers], [stops[n] for n in numbers]
+        return starts, stops
+
+def findConflict(series, other, numbers):
+    """ Looks for an occurrence of `other` overlapping one of the `numbers` occurrences of `series`. """
+    for n in numbers:
+        start, stop = series.getOccurrence(n)
+        for m in other.indexRange(start - MINUTE, stop + MINUTE):
+            return (start, stop), other.getOccurrence(m)
+    return None
+
+def seriesConflict(first, second):
+    """ Returns a pair of overlapping occurrences of two series, None if they never overlap.
+
+    Occurrences of fixed period series start at `start + n * period`, so the distance
+    between an occurrence of each series can only be `d + k * gcd(period_a, period_b)`.
+    Whether any of those distances makes two occurrences overlap is answered in constant
+    time. When one does, the overlap repeats every lcm(period_a, period_b), so a witness
+    is found within the first cycle of either series. Monthly series are expanded.
+    """
+    if first.getPeriod() == None:
+        return findConflict(first, second, range(first.countOccurrences()))
+    if second.getPeriod() == None:
+        pair = findConflict(second, first, range(second.countOccurrences()))
+        if pair != None:
+            pair = (pair[1], pair[0])
+        return pair
+
+    first_period = cons.REPEAT_MINUTES[first.getRepeat()]
+    second_period = cons.REPEAT_MINUTES[second.getRepeat()]
+    first_duration = toMinutes(first.getStop()) - toMinutes(first.getStart())
+    second_duration = toMinutes(second.getStop()) - toMinutes(second.getStart())
+    distance = toMinutes(first.getStart()) - toMinutes(second.getStart())
+    step = gcd(first_period, second_period)
+    if (distance + first_duration) % step - first_duration > second_duration:
+        return None
+
+    cycle = first_period * second_period // step
+    pair = findConflict(first, second, range(min(first.countOccurrences(), cycle // first_period)))
+    if pair == None:
+        pair = findConflict(second, first, range(min(second.countOccurrences(), cycle // second_period)))
+        if pair != None:
+            pair = (pair[1], pair[0])
+    return pair
+
+class EventStore(object):
+    """ Compact storage for every event of the calendar.
+
+    Starts and stops are packed as integer minutes since `EPOCH`, together with the
+    id of the series each row belongs to (-1 for single events). `Event` objects are
+    only created, as views, when a row is read. Events never overlap each other, so
+    rows ordered by start are also ordered by stop, and overlap or day queries are
+    binary searches.
+
+    Occurrences removed from a stored series are recorded by number in `exceptions`,
+    keyed by series id, so a series is always described by its rule and those numbers.
+
+    The number of events starting on each day and the minutes each day is busy are
+    kept up to date in `density`, keyed by day ordinal.
+    """
+    def __init__(self):
+        self.starts = array("i")
+        self.stops = array("i")
+        self.series_ids = array("i")
+        self.series = []
+        self.series_lookup = {}
+        self.exceptions = {}
+        self.density = {}
+
+    def __len__(self):
+        return len(self.starts)
+
+    def copy(self):
+        store = EventStore()
+        store.starts = self.starts[:]
+        store.stops = self.stops[:]
+        store.series_ids = self.series_ids[:]
+        store.series = list(self.series)
+        store.series_lookup = dict(self.series_lookup)
+        store.exceptions = {sid: set(numbers) for sid, numbers in self.exceptions.items()}
+        store.density = {day: list(value) for day, value in self.density.items()}
+        return store
+
+    def updateDensity(self, start, stop, sign = 1):
+        """ Adds (or subtracts when `sign` is -1) the event [`start`, `stop`] to the day index. """
+        day = start // DAY_MINUTES
+        self.density.setdefault(day + EPOCH_DAY, [0, 0])[0] += sign
+        while True:
+            value = self.density.setdefault(day + EPOCH_DAY, [0, 0])
+            end = min(stop, (day + 1) * DAY_MINUTES)
+            value[1] += sign * (end - start)
+            if value == [0, 0]:
+                del self.density[day + EPOCH_DAY]
+            if end == stop:
+                break
+            start = end
+            day += 1
+
+    def getDensity(self, date):
+        """ Returns the number of events starting on `date` and the minutes of `date` they keep busy. """
+        return tuple(self.density.get(date.toordinal(), (0, 0)))
+
+    def getSeriesId(self, series):
+        try:
+            return self.series_lookup[id(series)]
+        except KeyError:
+            sid = len(self.series)
+            self.series.append(series)
+            self.series_lookup[id(series)] = sid
+            return sid
+
+    def makeEvent(self, start, stop, sid):
+        parent = None
+        if sid >= 0:
+            parent = self.series[sid]
+        return Event(fromMinutes(start), fromMinutes(stop), parent)
+
+    def getEvent(self, i):
+        return self.makeEvent(self.starts[i], self.stops[i], self.series_ids[i])
+
+    def iterLines(self, size = 4096):
+        """ Yields the text of schedule.dat in chronological order, `size` events at a time. """
+        for first in range(0, len(self.starts), size):
+            yield formatLines(self.starts[first:first + size], self.stops[first:first + size])
+
+    def overlap(self, start, stop):
+        """ Returns the stored event overlapping [`start`, `stop`], None if there is none. """
+        i = bisect_right(self.starts, toMinutes(stop))
+        if i and (self.stops[i - 1] >= toMinutes(start)):
+            return self.getEvent(i - 1)
+        return None
+
+    def add(self, event):
+        sid = -1
+        if event.isChild():
+            sid = self.getSeriesId(event.getParent())
+        start = toMinutes(event.getStart())
+        i = bisect_left(self.starts, start)
+        self.starts.insert(i, start)
+        self.stops.insert(i, toMinutes(event.getStop()))
+        self.series_ids.insert(i, sid)
+        self.updateDensity(start, self.stops[i])
+
+    def checkSeries(self, series):
+        """ Compares `series` with every stored series without expanding them.
+        Raises:
+            SystemError: when an occurrence of `series` overlaps a stored occurrence.
+        """
+        for sid in range(len(self.series)):
+            other = self.series[sid]
+            if (other == None) or (other is series):
+                continue
+            pair = seriesConflict(series, other)
+            if (pair == None) or (series.getIndex(pair[0][0]) in series.getExceptions()):
+                continue
+            start = toMinutes(pair[1][0])
+            i = bisect_left(self.starts, start)
+            if (i < len(self.starts)) and (self.starts[i] == start) and (self.series_ids[i] == sid):
+                event, item = [Event(*dates) for dates in pair]
+                raise(SystemError("The following times overlap: (%s) and (%s) on %s."%(item, event, item.getDate().strftime("%Y/%m/%d"))))
+
+    def addSeries(self, series):
+        """ Validates every occurrence of `series` in a single sweep and adds them all, or none.
+
+        The new intervals are merged, in start order, with the stored events they can
+        reach. Walking the merged rows while keeping the furthest stop seen so far finds
+        every occurrence that overlaps an event, or another occurrence, in one pass.
+        Raises:
+            SystemError: listing the conflicts, the calendar is left untouched.
+        """
+        starts, stops = series.getMinutes()
+        if len(starts) == 0:
+            return
+        self.checkSeries(series)
+        sid = self.series_lookup.get(id(series), len(self.series))
+        first = bisect_left(self.starts, starts[0])
+        if first and (self.stops[first - 1] >= starts[0]):
+            first -= 1
+        last = bisect_right(self.starts, max(stops))
+
+        old = zip(self.starts[first:last], self.stops[first:last], self.series_ids[first:last])
+        new = zip(starts, stops, repeat(sid))
+        merged_starts = array("i")
+        merged_stops = array("i")
+        merged_ids = array("i")
+        conflicts = []
+        reach = None
+        for row in merge(old, new):
+            if (reach != None) and (row[0] <= reach[1]) and (sid in (row[2], reach[2])):
+                conflicts.append((reach, row))
+            if (reach == None) or (row[1] > reach[1]):
+                reach = row
+            merged_starts.append(row[0])
+            merged_stops.append(row[1])
+            merged_ids.append(row[2])
+
+        if len(conflicts):
+            item, event = [Event(fromMinutes(row[0]), fromMinutes(row[1])) for row in conflicts[0]]
+            txt = "The following times overlap: (%s) and (%s) on %s."%(item, event, item.getDate().strftime("%Y/%m/%d"))
+            if len(conflicts) > 1:
+                txt += "\n%d occurrences of the series overlap in total."%len(conflicts)
+            raise(SystemError(txt))
+
+        self.getSeriesId(series)
+        self.starts[first:last] = merged_starts
+        self.stops[first:last] = merged_stops
+        self.series_ids[first:last] = merged_ids
+        for start, stop in zip(starts, stops):
+            self.updateDensity(start, stop)
+
+    def remove(self, event):
+        start = toMinutes(event.getStart())
+        i = bisect_left(self.starts, start)
+        if (i < len(self.starts)) and (self.starts[i] == start):
+            sid = self.series_ids[i]
+            if sid >= 0:
+                n = self.series[sid].getIndex(event.getStart())
+                self.exceptions.setdefault(sid, set()).add(n)
+            self.updateDensity(start, self.stops[i], -1)
+            del self.starts[i]
+            del self.stops[i]
+            del self.series_ids[i]
+        else:
+            raise ValueError("Event is not in the calendar.")
+
+    def seriesRows(self, sid):
+        """ Positions of the rows of the series `sid`.
+
+        The starts of the occurrences come from the rule, in order, so each one is
+        located with a binary search beginning after the previous row found.
+        """
+        rows = []
+        first = 0
+        for start in self.series[sid].getMinutes()[0]:
+            i = bisect_left(self.starts, start, first)
+            if (i < len(self.starts)) and (self.starts[i] == start) and (self.series_ids[i] == sid):
+                rows.append(i)
+                first = i + 1
+            else:
+                first = i
+        return rows
+
+    def deleteRows(self, rows):
+        """ Removes the rows at the ascending positions `rows`, copying the runs kept between them. """
+        starts = array("i")
+        stops = array("i")
+        series_ids = array("i")
+        first = 0
+        for i in rows:
+            self.updateDensity(self.starts[i], self.stops[i], -1)
+            starts += self.starts[first:i]
+            stops += self.stops[first:i]
+            series_ids += self.series_ids[first:i]
+            first = i + 1
+        self.starts = starts + self.starts[first:]
+        self.stops = stops + self.stops[first:]
+        self.series_ids = series_ids + self.series_ids[first:]
+
+    def removeSeries(self, series):
+        sid = self.series_lookup.pop(id(series), None)
+        if sid == None:
+            return
+        self.deleteRows(self.seriesRows(sid))
+        self.series[sid] = None
+        self.exceptions.pop(sid, None)
+
+    def dayRange(self, date, last_date = None):
+        """ Rows of the events starting on `date`, or from `date` up to `last_date` included. """
+        if last_date == None:
+            last_date = date
+        begin = (date.toordinal() - EPOCH_DAY) * DAY_MINUTES
+        end = (last_date.toordinal() + 1 - EPOCH_DAY) * DAY_MINUTES
+        first = bisect_left(self.starts, begin)
+        last = bisect_left(self.starts, max(begin, end), first)
+        return first, last
+
+    def getRules(self):
+        """ Describes the calendar by its single events and the rule of each series.
+
+        Occurrences removed from a series are written as its exceptions, so the
+        rows of a series never need to be stored.
+        """
+        singles = []
+        for start, stop, sid in zip(self.starts, self.stops, self.series_ids):
+            if sid < 0:
+                singles.append((fromMinutes(start), fromMinutes(stop)))
+        rules = []
+        for sid in range(len(self.series)):
+            series = self.series[sid]
+            if series == None:
+                continue
+            count = series.countOccurrences()
+            exceptions = series.getExceptions() | self.exceptions.get(sid, set())
+            if len([n for n in exceptions if n < count]) == count:
+                continue
+            rule = RepeatableEvent(series.getStart(), series.getStop(), series.getUntil(), series.getRepeat(), exceptions)
+            rules.append(rule.getRule())
+        return {"version": FORMAT_VERSION, "events": singles, "series": rules}
+
+    @classmethod
+    def fromRules(cls, rules):
+        store = cls()
+        for start, stop in rules["events"]:
+            store.add(Event(start, stop))
+        for rule in rules["series"]:
+            store.addSeries(RepeatableEvent(*rule))
+        return store
+
+    @classmethod
+    def fromEvents(cls, events, dropped = None):
+        """ Builds a store from the former dictionary of day lists, keyed by "%Y/%m/%d" strings.
+
+        Every series is turned back into its rule: occurrences missing from the
+        file become exceptions, and children that no longer match the rule are
+        kept as single events.
+
+        The former calendar only compared events starting on the same day, so old files
+        may hold events overlapping across midnight.
+        Args:
+            dropped (list): when given, events overlapping an event already migrated are
+                left out and appended to it instead of failing.
+        Raises:
+            SystemError: on the first overlap, when `dropped` is None.
+        """
+        store = cls()
+        children = {}
+        parents = {}
+
+        def addSingle(event):
+            item = store.overlap(event.getStart(), event.getStop())
+            if item == None:
+                store.add(event)
+            elif dropped != None:
+                dropped.append(event)
+            else:
+                raise(SystemError("The following times overlap: (%s) and (%s) on %s."%(item, event, item.getDate().strftime("%Y/%m/%d"))))
+
+        for day in events.values():
+            for event in day:
+                if event.isChild():
+                    parent = event.getParent()
+                    parents[id(parent)] = parent
+                    children.setdefault(id(parent), []).append(event)
+                else:
+                    addSingle(Event(event.getStart(), event.getStop()))
+        for key in parents:
+            parent = parents[key]
+            series = RepeatableEvent(parent.start, parent.stop, parent.until, parent.every)
+            numbers = set()
+            for event in children[key]:
+                n = series.getIndex(event.getStart())
+                if (n == None) or (series.getOccurrence(n)[1] != event.getStop()):
+                    addSingle(Event(event.getStart(), event.getStop()))
+                else:
+                    numbers.add(n)
+            series.exceptions = set(range(series.countOccurrences())) - numbers
+            try:
+                store.addSeries(series)
+            except SystemError:
+                if dropped == None:
+                    raise
+                store.dropConflicts(series, dropped)
+                store.addSeries(series)
+        return store
+
+    def dropConflicts(self, series, dropped):
+        """ Turns the occurrences of `series` overlapping a stored event, or an earlier
+        occurrence, into exceptions and appends them to `dropped`.
+        """
+        reach = None
+        for n in series.indexRange():
+            if n in series.exceptions:
+                continue
+            start, stop = series.getOccurrence(n)
+            if (self.overlap(start, stop) != None) or ((reach != None) and (start <= reach)):
+                series.exceptions.add(n)
+                dropped.append(Event(start, stop, series))
+            else:
+                reach = stop
+
+    @classmethod
+    def load(cls, data, dropped = None):
+        """ Builds a store from the contents of a .tfc file, in any of its versions.
+        Former files are migrated with `fromEvents`, see there for `dropped`.
+        """
+        if "version" in data:
+            return cls.fromRules(data)
+        return cls.fromEvents(data, dropped)
@@ -1,14 +1,34 @@
+import os
 import sys
 
-DRIVES = []
+DRIVES_POLL = 1
+USAGE_TTL = 5
+MOUNTINFO = "/proc/self/mountinfo"
 
 CURRENT_OS = sys.platform
+CONFIG_FOLDER = os.path.join(os.path.expanduser("~"), ".forestcalendar")
 
 FC_EXTENSION = ".tfc"
 
 DONE_FILENAME = "done.dat"
 SCHEDULE_FILENAME = "schedule.dat"
+SCHEDULE_TEMP = SCHEDULE_FILENAME + ".tmp"
 SAVE_FILENAME = "schedule" + FC_EXTENSION
 REPEAT_OPTIONS = ["Hour", "Day", "Week", "Month"]
+REPEAT_MINUTES = {"Hour": 60, "Day": 60 * 24, "Week": 60 * 24 * 7}
 
 PLUGIN_FILE = "v44k1q05.img"
+
+PROBE_TIMEOUT = 3
+PROBE_GRACE = 0.5
+PORTS_CACHE = "ports.json"
+DRIFT_LOG = "drift.json"
+DRIFT_THRESHOLD = 0.5
+SYNC_TIMEOUT = 10
+RETRY_ATTEMPTS = 5
+RETRY_DELAY = 0.1
+RETRY_DEADLINE = 8
+SYNC_MARGIN = 0.05
+PING_SAMPLES = 5
+WRITE_BUFFER = 64 * 1024
+VIEW_PAGE = 256
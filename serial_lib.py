@@ -0,0 +1,520 @@
+import os
+import json
+from time import sleep, monotonic, perf_counter, time
+from datetime import datetime, timedelta
+from threading import Thread
+
+from serial import Serial
+import serial.tools.list_ports as find_ports
+
+import cons
+
+def portKey(port):
+    """ Hardware identity of a port: VID, PID, serial number and location for USB
+    devices, the device name and hardware id string otherwise. """
+    if port.vid != None:
+        return "%04X:%04X:%s:%s"%(port.vid, port.pid, port.serial_number, port.location)
+    return "%s:%s"%(port.device, port.hwid)
+
+def deviceKeys():
+    """ `portKey` of every serial port connected, keyed by device name. """
+    return {port.device: portKey(port) for port in find_ports.comports()}
+
+class JsonFile(object):
+    """ Dictionary kept in a JSON file of the configuration folder, read when first used. """
+    def __init__(self, path):
+        self.path = path
+        self.entries = None
+
+    def getEntries(self):
+        if self.entries == None:
+            self.entries = {}
+            try:
+                with open(self.path) as file:
+                    self.entries = json.load(file)
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                print(self.path, e)
+        return self.entries
+
+    def save(self):
+        entries = self.getEntries()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok = True)
+            with open(self.path, "w") as file:
+                json.dump(entries, file, indent = 1)
+        except OSError as e:
+            print(self.path, e)
+
+class PortCache(JsonFile):
+    """ Persistent record of the serial ports already probed.
+
+    Ports are keyed by `portKey`, so a recorder is recognised whatever COM name it gets
+    and a device that answered something else than the banner is only probed again
+    when its hardware identity changes.
+    """
+    def __init__(self, path):
+        super(PortCache, self).__init__(path)
+        self.devices = {}
+
+    def get(self, port):
+        """ True for a known recorder, False for a device that failed, None if unknown. """
+        key = portKey(port)
+        self.devices[port.device] = key
+        return self.getEntries().get(key)
+
+    def set(self, port, is_recorder):
+        key = portKey(port)
+        self.devices[port.device] = key
+        self.getEntries()[key] = is_recorder
+
+    def forget(self, device):
+        """ Drops the entry of `device`, so it is probed again on the next search. """
+        try:
+            del self.getEntries()[self.devices[device]]
+            self.save()
+        except KeyError:
+            pass
+
+class DriftLog(JsonFile):
+    """ History of the clock offset of every recorder, keyed by `portKey`.
+
+    Each entry holds the samples (host time, offset in seconds) taken since the
+    recorder was last synchronized, from which its drift rate is estimated.
+    """
+    def getSamples(self, key):
+        try:
+            return self.getEntries()[key]["samples"]
+        except KeyError:
+            return []
+
+    def add(self, key, name, offset, when = None):
+        if when == None:
+            when = time()
+        entry = self.getEntries().setdefault(key, {"name": name, "samples": []})
+        entry["name"] = name
+        entry["samples"].append((when, offset))
+
+    def reset(self, key, name, offset = None):
+        """ Starts a new history for a recorder that has just been synchronized. """
+        self.getEntries()[key] = {"name": name, "samples": []}
+        if offset != None:
+            self.add(key, name, offset)
+
+    def getOffset(self, key):
+        samples = self.getSamples(key)
+        if len(samples):
+            return samples[-1][1]
+        return None
+
+    def getDrift(self, key):
+        """ Drift rate in parts per million: least squares slope of the offsets in time. """
+        samples = self.getSamples(key)
+        if len(samples) < 2:
+            return None
+        n = len(samples)
+        mean_time = sum(sample[0] for sample in samples) / n
+        mean_offset = sum(sample[1] for sample in samples) / n
+        variance = sum((sample[0] - mean_time) ** 2 for sample in samples)
+        if variance == 0:
+            return None
+        covariance = sum((sample[0] - mean_time) * (sample[1] - mean_offset) for sample in samples)
+        return covariance / variance * 1e6
+
+    def needsSync(self, key, threshold = cons.DRIFT_THRESHOLD):
+        offset = self.getOffset(key)
+        return (offset != None) and (abs(offset) > threshold)
+
+cache = PortCache(os.path.join(cons.CONFIG_FOLDER, cons.PORTS_CACHE))
+drift_log = DriftLog(os.path.join(cons.CONFIG_FOLDER, cons.DRIFT_LOG))
+
+def probePort(port, deadline, results):
+    """ Stores in `results` whether a recorder greets on `port` before `deadline`, None
+    when the port stays silent.
+    """
+    try:
+        com = RecorderSerial(port.device)
+        try:
+            com.timeout = max(deadline - monotonic(), 0)
+            results[port.device] = com.testRecorder()
+        finally:
+            com.close()
+    except Exception as e:
+        print(e)
+
+def findPorts(timeout = cons.PROBE_TIMEOUT):
+    """ Probes every serial port at the same time.
+
+    Each port gets `timeout` seconds to open and send its banner, so the discovery
+    takes as long as the slowest port instead of the sum of all of them. Ports still
+    busy after that are left behind in their daemon threads. Ports found in `cache`
+    are not probed: known recorders are taken as they are and devices that answered
+    something else than the banner before are skipped. Silent ports are not cached,
+    a recorder slow to greet is probed again on the next search.
+    Returns:
+        dict: the name to show for every recorder found, keyed by its device. Identical
+            recorders share their description, so the device is part of the name.
+    """
+    ports_objects = list(find_ports.comports())
+    results = {}
+    unknown = []
+    for port in ports_objects:
+        known = cache.get(port)
+        if known == None:
+            unknown.append(port)
+        else:
+            results[port.device] = known
+
+    deadline = monotonic() + timeout
+    threads = []
+    for port in unknown:
+        thread = Thread(target = probePort, args = (port, deadline, results))
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join(max(deadline - monotonic(), 0) + cons.PROBE_GRACE)
+    for port in unknown:
+        if results.get(port.device) != None:
+            cache.set(port, results[port.device])
+    if len(unknown):
+        cache.save()
+
+    ports = {}
+    for port in ports_objects:
+        if results.get(port.device):
+            ports[port.device] = "%s (%s)"%(port.description, port.device)
+    return ports
+
+class RetryPolicy(object):
+    """ Bounds the retries of a recorder command.
+
+    An attempt is made at most `attempts` times. Between attempts the policy waits
+    `delay` seconds, multiplied by `factor` after every failure, and it gives up before
+    waiting past `deadline` seconds from the first attempt. An attempt already started
+    still runs to its own serial timeout. The duration of every attempt is kept in
+    `timings`.
+    """
+    def __init__(self, attempts = cons.RETRY_ATTEMPTS, delay = cons.RETRY_DELAY, factor = 2, deadline = cons.RETRY_DEADLINE):
+        self.attempts = attempts
+        self.delay = delay
+        self.factor = factor
+        self.deadline = deadline
+        self.timings = []
+
+    def run(self, attempt):
+        """ Calls `attempt()` until it returns something other than None, and returns that.
+        Raises:
+            TimeoutError: when no attempt succeeds within the policy.
+        """
+        self.timings = []
+        start = monotonic()
+        delay = self.delay
+        while True:
+            begin = monotonic()
+            result = attempt()
+            self.timings.append(monotonic() - begin)
+            if result != None:
+                return result
+            if (len(self.timings) >= self.attempts) or (monotonic() + delay - start > self.deadline):
+                break
+            sleep(delay)
+            delay *= self.factor
+        raise(TimeoutError("No valid answer after %d attempts in %.1f s."%(len(self.timings), monotonic() - start)))
+
+class RecorderSerial(Serial):
+    def __init__(self, port, baudrate = 9600, timeout = 2):
+        super(RecorderSerial, self).__init__(port, baudrate = baudrate, timeout = timeout)
+        self.retry = None
+        sleep(1)
+
+    def testRecorder(self):
+        """ Reads the greeting of the port.
+        Returns:
+            bool: whether the line received is the recorder banner, None when nothing
+                arrived before the timeout.
+        """
+        line = self.readline()
+        if line == b"":
+            return None
+        try:
+            line = line.decode()
+            if line == "Connection\r\n":
+                return True
+        except:
+            pass
+        return False
+
+    def decode(self, line):
+        return line.decode().replace("\r\n", "")
+
+    def timeMessage(self, time):
+        temp = time.strftime("%d%m%y%H%M%S")
+        ascii_time = [ord(i) for i in temp]
+        return [0x00] + ascii_time
+
+    def setTime(self, time = None, clock = None, policy = None):
+        """ Sets the clock of the recorder, resending until it confirms.
+        Args:
+            time (datetime): time to send.
+            clock (function): returns the time to send. It is called again before every
+                retry so a resent message is never stale, and takes precedence over `time`.
+            policy (RetryPolicy): bounds the retries, a default one when None. It is kept
+                in `self.retry` with the timing of every attempt.
+        Raises:
+            TimeoutError: when the policy runs out before the recorder confirms.
+        """
+        if policy == None:
+            policy = RetryPolicy()
+        self.retry = policy
+
+        def attempt():
+            message = self.timeMessage(clock() if clock != None else time)
+            self.reset_input_buffer()
+            self.write(message)
+            ans = self.decode(self.readline())
+            try:
+                return datetime.strptime(ans, '%d,%m,%y,%H,%M,%S')
+            except:
+                return None
+
+        return policy.run(attempt)
+
+    def getTime(self):
+        self.write([1])
+        ans = self.readline()
+        ans = self.decode(ans)
+        try:
+            return datetime.strptime(ans, '%d,%m,%y,%H,%M,%S')
+        except:
+            return ans
+
+    def measureLatency(self, samples = cons.PING_SAMPLES):
+        """ Shortest round trip, in seconds, of `samples` getTime requests. """
+        self.reset_input_buffer()
+        latency = None
+        for i in range(samples):
+            start = perf_counter()
+            answer = self.getTime()
+            elapsed = perf_counter() - start
+            if isinstance(answer, datetime) and ((latency == None) or (elapsed < latency)):
+                latency = elapsed
+        if latency == None:
+            raise(TimeoutError("Recorder did not answer the time requests."))
+        return latency
+
+    def setTimePrecise(self, clock, latency):
+        """ Sets the clock of the recorder on a whole second boundary of `clock`.
+
+        The recorder only keeps whole seconds, so the message carries the next second of
+        `clock` and is sent half a round trip (`latency`) before that second begins,
+        reaching the recorder as its new second should start. The wait and the payload
+        are worked out again on every retry.
+        """
+        def aligned():
+            now = clock()
+            target = (now + timedelta(seconds = latency / 2 + cons.SYNC_MARGIN)).replace(microsecond = 0) + timedelta(seconds = 1)
+            sleep(max((target - now).total_seconds() - latency / 2, 0))
+            return target
+        self.setTime(clock = aligned)
+
+    def measureOffset(self, clock, timeout = 2):
+        """ Offset, in seconds, of the recorder clock from `clock`, positive when ahead.
+
+        The recorder is polled until its seconds tick over. The tick is placed halfway
+        between the two answers around it, each one timed at the middle of its round
+        trip, so the result is good to about one round trip.
+        """
+        self.reset_input_buffer()
+        previous = None
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
+            before = clock()
+            answer = self.getTime()
+            after = clock()
+            if not isinstance(answer, datetime):
+                continue
+            middle = before + (after - before) / 2
+            if (previous != None) and (answer != previous[0]):
+                tick = previous[1] + (middle - previous[1]) / 2
+                return (answer - tick).total_seconds()
+            previous = (answer, middle)
+        raise(TimeoutError("Recorder clock did not tick."))
+
+    def reset(self):
+        self.write([2])
+
+class SyncResult(object):
+    """ Outcome of synchronizing one recorder.
+
+    Times are in seconds from the reference instant of the synchronization. `offset`
+    is the difference between the recorder clock and the reference timeline, negative
+    when the recorder is behind: in precise mode it is measured on the recorder, else
+    it is the fraction of a second dropped from the time sent.
+    """
+    def __init__(self, name, device):
+        self.name = name
+        self.device = device
+        self.serial = None
+        self.sent = None
+        self.completed = None
+        self.offset = None
+        self.latency = None
+        self.timings = []
+        self.error = None
+
+    def isSuccessful(self):
+        return (self.error == None) and (self.completed != None)
+
+    def __repr__(self):
+        if self.error != None:
+            if len(self.timings):
+                return "%s: %s (%s)"%(self.name, self.error, ", ".join("%.2f s"%timing for timing in self.timings))
+            return "%s: %s"%(self.name, self.error)
+        txt = "%s: done in %.3f s, offset %+.3f s"%(self.name, self.completed, self.offset)
+        if self.latency != None:
+            txt += ", round trip %.3f s"%self.latency
+        if len(self.timings) > 1:
+            txt += ", %d attempts"%len(self.timings)
+        return txt
+
+def runAll(target, results, timeout):
+    """ Calls `target(result)` for every result in its own daemon thread, waiting at most `timeout` seconds. """
+    deadline = monotonic() + timeout
+    threads = []
+    for result in results:
+        thread = Thread(target = target, args = (result,))
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join(max(deadline - monotonic(), 0))
+    return [thread.is_alive() for thread in threads]
+
+def synchronize(ports, precise = False, timeout = cons.SYNC_TIMEOUT, progress = None, cancelled = None):
+    """ Sets the clocks of all the recorders in `ports` at once.
+
+    Every port is opened in parallel. A single reference instant is captured once they
+    are all ready, and each recorder then receives the time of that same timeline at
+    the moment its message leaves, all of them concurrently. When `precise` the time is
+    sent on a second boundary compensating the serial round trip
+    (`RecorderSerial.setTimePrecise`) and the offset achieved is measured afterwards.
+
+    Args:
+        progress (callable): called with each `SyncResult` as soon as it is done, from
+            the thread that handled it.
+        cancelled (callable): polled once every port is open and by every recorder
+            before its time is sent; when it returns True the recorders not set yet
+            are left untouched and their results are marked as cancelled.
+    Returns:
+        list: a `SyncResult` per port.
+    """
+    results = [SyncResult(ports[device], device) for device in ports]
+
+    def isCancelled():
+        return (cancelled != None) and cancelled()
+
+    def connect(result):
+        try:
+            result.serial = RecorderSerial(port = result.device, timeout = 2)
+        except Exception as e:
+            result.error = e
+
+    for result, alive in zip(results, runAll(connect, results, timeout)):
+        if alive:
+            result.error = TimeoutError("Port could not be opened.")
+
+    if isCancelled():
+        for result in results:
+            try: result.serial.close()
+            except: pass
+            if result.error == None:
+                result.error = InterruptedError("Synchronization cancelled.")
+        return results
+
+    reference = datetime.now()
+    reference_clock = monotonic()
+
+    def clock():
+        return reference + timedelta(seconds = monotonic() - reference_clock)
+
+    def send(result):
+        try:
+            if isCancelled():
+                raise InterruptedError("Synchronization cancelled.")
+            if precise:
+                result.latency = result.serial.measureLatency()
+                if isCancelled():
+                    raise InterruptedError("Synchronization cancelled.")
+                result.sent = monotonic() - reference_clock
+                result.serial.setTimePrecise(clock, result.latency)
+                result.offset = result.serial.measureOffset(clock)
+            else:
+                result.sent = monotonic() - reference_clock
+                sent = []
+                def stamped():
+                    sent.append(clock())
+                    return sent[-1]
+                result.serial.setTime(clock = stamped)
+                result.offset = -sent[-1].microsecond / 1e6
+            result.serial.reset()
+            result.completed = monotonic() - reference_clock
+        except Exception as e:
+            result.error = e
+        try:
+            result.timings = result.serial.retry.timings
+        except AttributeError:
+            pass
+        try: result.serial.close()
+        except: pass
+        if progress != None:
+            progress(result)
+
+    ready = [result for result in results if result.error == None]
+    for result, alive in zip(ready, runAll(send, ready, timeout)):
+        if alive:
+            result.error = TimeoutError("Recorder did not answer.")
+    return results
+
+def getSkew(results):
+    """ Spread, in seconds, of the offsets of the recorders synchronized. """
+    offsets = [result.offset for result in results if result.isSuccessful()]
+    if len(offsets):
+        return max(offsets) - min(offsets)
+    return 0
+
+def survey(ports, timeout = cons.SYNC_TIMEOUT, progress = None, cancelled = None):
+    """ Reads the clock of all the recorders in `ports` at once, without changing them.
+    `progress` and `cancelled` work as in `synchronize`; a cancelled survey stops
+    reading the recorders not measured yet.
+    Returns:
+        list: a `SyncResult` per port, whose `offset` is the recorder clock minus the
+            host clock, measured with `RecorderSerial.measureOffset`.
+    """
+    results = [SyncResult(ports[device], device) for device in ports]
+    reference_clock = monotonic()
+
+    def read(result):
+        try:
+            serial = RecorderSerial(port = result.device, timeout = 2)
+            try:
+                if (cancelled != None) and cancelled():
+                    raise InterruptedError("Survey cancelled.")
+                result.latency = serial.measureLatency()
+                if (cancelled != None) and cancelled():
+                    raise InterruptedError("Survey cancelled.")
+                result.sent = monotonic() - reference_clock
+                result.offset = serial.measureOffset(datetime.now)
+                result.completed = monotonic() - reference_clock
+            finally:
+                serial.close()
+        except Exception as e:
+            result.error = e
+        if progress != None:
+            progress(result)
+
+    for result, alive in zip(results, runAll(read, results, timeout)):
+        if alive:
+            result.error = TimeoutError("Recorder did not answer.")
+    return results
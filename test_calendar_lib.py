@@ -0,0 +1,147 @@
+""" Checks of the series arithmetic and of the event store against brute force expansion.
+
+Run with: python -m unittest test_calendar_lib
+"""
+import random
+import unittest
+from datetime import datetime, timedelta
+
+from calendar_lib import Event, RepeatableEvent, EventStore, seriesConflict, toMinutes
+
+BASE = datetime(2030, 1, 1)
+MAX_DURATION = {"Hour": 40, "Day": 300, "Week": 600, "Month": 600}
+
+def overlaps(first, second):
+    return (first[0] <= second[1]) and (second[0] <= first[1])
+
+def randomSeries(rng, span = 30, days = 60):
+    every = rng.choice(["Hour", "Day", "Week", "Month"])
+    start = BASE + timedelta(minutes = rng.randrange(0, 60 * 24 * span))
+    stop = start + timedelta(minutes = rng.randrange(1, MAX_DURATION[every]))
+    until = (start + timedelta(days = rng.randrange(0, days))).date()
+    return RepeatableEvent(start, stop, until, every)
+
+def rows(store):
+    return list(zip(store.starts, store.stops))
+
+class SeriesConflictTest(unittest.TestCase):
+    def testMatchesExpansion(self):
+        rng = random.Random(5)
+        for trial in range(1500):
+            first = randomSeries(rng)
+            second = randomSeries(rng)
+            expanded = [list(series.datesGenerator()) for series in (first, second)]
+            expected = any(overlaps(a, b) for a in expanded[0] for b in expanded[1])
+            pair = seriesConflict(first, second)
+            self.assertEqual(pair != None, expected, trial)
+            if pair != None:
+                self.assertTrue(overlaps(*pair))
+                self.assertIn(pair[0], expanded[0])
+                self.assertIn(pair[1], expanded[1])
+
+class AddSeriesTest(unittest.TestCase):
+    def testAllOrNothing(self):
+        rng = random.Random(3)
+        for trial in range(300):
+            store = EventStore()
+            for i in range(rng.randrange(0, 30)):
+                start = BASE + timedelta(minutes = rng.randrange(0, 60 * 24 * 20))
+                stop = start + timedelta(minutes = rng.randrange(1, 300))
+                if store.overlap(start, stop) == None:
+                    store.add(Event(start, stop))
+            for i in range(rng.randrange(0, 3)):
+                try:
+                    store.addSeries(randomSeries(rng, 10, 20))
+                except SystemError:
+                    pass
+            series = randomSeries(rng, 10, 40)
+            before = rows(store)
+            new = list(zip(*series.getMinutes()))
+            expected = any(overlaps(a, b) for a in new for b in before) or \
+                any(overlaps(new[i], new[i + 1]) for i in range(len(new) - 1))
+            try:
+                store.addSeries(series)
+                conflict = False
+            except SystemError:
+                conflict = True
+            self.assertEqual(conflict, expected, trial)
+            if conflict:
+                self.assertEqual(rows(store), before)
+            else:
+                self.assertEqual(rows(store), sorted(before + new))
+
+    def testMonthEndKeepsDuration(self):
+        series = RepeatableEvent(datetime(2026, 1, 30, 23), datetime(2026, 1, 31, 1), datetime(2026, 6, 1).date(), "Month")
+        store = EventStore()
+        store.addSeries(series)
+        self.assertTrue(all(start < stop for start, stop in rows(store)))
+        self.assertEqual(list(store.stops), sorted(store.stops))
+        self.assertNotEqual(store.overlap(datetime(2026, 2, 28), datetime(2026, 2, 28, 23, 30)), None)
+
+class RemoveTest(unittest.TestCase):
+    def testRulesRoundTrip(self):
+        rng = random.Random(11)
+        store = EventStore()
+        added = []
+        for trial in range(400):
+            choice = rng.random()
+            if choice < 0.3:
+                start = BASE + timedelta(minutes = rng.randrange(0, 60 * 24 * 60, 15))
+                stop = start + timedelta(minutes = rng.choice([10, 300, 1500]))
+                if store.overlap(start, stop) == None:
+                    store.add(Event(start, stop))
+            elif choice < 0.5:
+                series = randomSeries(rng, 60, 40)
+                try:
+                    store.addSeries(series)
+                    added.append(series)
+                except SystemError:
+                    pass
+            elif (choice < 0.8) and len(store):
+                store.remove(store.getEvent(rng.randrange(len(store))))
+            elif len(added):
+                series = added.pop(rng.randrange(len(added)))
+                sid = store.series_lookup[id(series)]
+                store.removeSeries(series)
+                self.assertNotIn(sid, store.series_ids)
+            loaded = EventStore.fromRules(store.getRules())
+            self.assertEqual(rows(loaded), rows(store), trial)
+
+class MigrationTest(unittest.TestCase):
+    def legacy(self, events):
+        days = {}
+        for event in events:
+            days.setdefault(event.getDate().strftime("%Y/%m/%d"), []).append(event)
+        return days
+
+    def testSeriesBecomeRules(self):
+        series = RepeatableEvent(BASE.replace(hour = 10), BASE.replace(hour = 10, minute = 30), (BASE + timedelta(days = 9)).date(), "Day")
+        children = [Event(start, stop, series) for start, stop in series.datesGenerator()]
+        del children[2]
+        moved = children.pop(4)
+        children.append(Event(moved.getStart() + timedelta(hours = 1), moved.getStop() + timedelta(hours = 1), series))
+        single = Event(BASE.replace(hour = 12), BASE.replace(hour = 13))
+        store = EventStore.fromEvents(self.legacy(children + [single]))
+        self.assertEqual(rows(store), sorted((toMinutes(event.getStart()), toMinutes(event.getStop())) for event in children + [single]))
+        rules = store.getRules()
+        self.assertEqual(len(rules["series"]), 1)
+        self.assertEqual(rules["series"][0][4], [2, 5])
+        self.assertEqual(len(rules["events"]), 2)
+
+    def testOverlapsAcrossMidnight(self):
+        first = RepeatableEvent(BASE.replace(hour = 23), BASE.replace(hour = 23) + timedelta(hours = 2), (BASE + timedelta(days = 4)).date(), "Day")
+        second = RepeatableEvent(BASE.replace(hour = 0, minute = 30) + timedelta(days = 1), BASE.replace(hour = 2) + timedelta(days = 1), (BASE + timedelta(days = 4)).date(), "Day")
+        late = Event(BASE.replace(hour = 23) + timedelta(days = 9), BASE.replace(hour = 1) + timedelta(days = 10))
+        early = Event(BASE.replace(hour = 0, minute = 30) + timedelta(days = 10), BASE.replace(hour = 2) + timedelta(days = 10))
+        events = [Event(start, stop, series) for series in (first, second) for start, stop in series.datesGenerator()]
+        days = self.legacy(events + [late, early])
+        self.assertRaises(SystemError, EventStore.fromEvents, days)
+        dropped = []
+        store = EventStore.fromEvents(days, dropped)
+        self.assertEqual(len(store) + len(dropped), len(events) + 2)
+        self.assertTrue(all(store.starts[i + 1] > store.stops[i] for i in range(len(store) - 1)))
+        for event in dropped:
+            self.assertNotEqual(store.overlap(event.getStart(), event.getStop()), None)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,54 +3,228 @@ import sys
 import cons
 import psutil
 import shutil
-from time import sleep
-from threading import Thread
+import select
+import hashlib
+from time import sleep, monotonic
+from threading import Thread, Lock
+
+PLUGIN_DIGEST = None
+
+def pluginPath():
+    try:
+        return os.path.join(sys._MEIPASS, cons.PLUGIN_FILE)
+    except AttributeError:
+        return cons.PLUGIN_FILE
+
+def fileDigest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(cons.WRITE_BUFFER), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def pluginDigest():
+    """ Size and digest of the bundled plugin image, computed once per process. """
+    global PLUGIN_DIGEST
+    if PLUGIN_DIGEST == None:
+        path = pluginPath()
+        PLUGIN_DIGEST = (os.path.getsize(path), fileDigest(path))
+    return PLUGIN_DIGEST
 
 class SD(object):
     def __init__(self, drive):
         self.drive = drive
-        space = psutil.disk_usage(self.drive)
-        self.total = space.total / 1024**3
-        self.used = space.used / 1024**3
-        self.free = space.free / 1014**3
-        self.percent = space.percent
+        self.usage = None
+        self.usage_time = 0
 
     def getDrive(self):
         return self.drive
 
-    def save(self, txt):
+    def getUsage(self):
+        """ Disk usage of the card, read when first needed and kept for `cons.USAGE_TTL` seconds. """
+        now = monotonic()
+        if (self.usage == None) or (now - self.usage_time > cons.USAGE_TTL):
+            self.usage = psutil.disk_usage(self.drive)
+            self.usage_time = now
+        return self.usage
+
+    @property
+    def total(self):
+        return self.getUsage().total / 1024**3
+
+    @property
+    def used(self):
+        return self.getUsage().used / 1024**3
+
+    @property
+    def free(self):
+        return self.getUsage().free / 1024**3
+
+    @property
+    def percent(self):
+        return self.getUsage().percent
+
+    def hasPlugin(self):
+        """ Checks whether the card already holds an identical copy of the plugin image. """
+        path = os.path.join(self.drive, cons.PLUGIN_FILE)
+        size, digest = pluginDigest()
+        try:
+            return (os.path.getsize(path) == size) and (fileDigest(path) == digest)
+        except OSError:
+            return False
+
+    def save(self, lines):
+        """ Writes the schedule `lines` to the card as they are produced.
+
+        The lines go to a temporary file first, which only replaces the schedule once
+        all of them are written: when `lines` raises (the export is cancelled) or the
+        write fails, the card keeps its previous schedule untouched.
+        Returns:
+            list: (file name, size in bytes, written) for every file of the export,
+                `written` is False when the file on the card was already up to date.
+        """
+        schedule = os.path.join(self.drive, cons.SCHEDULE_FILENAME)
+        temporary = os.path.join(self.drive, cons.SCHEDULE_TEMP)
+        try:
+            with open(temporary, "w", buffering = cons.WRITE_BUFFER) as file:
+                file.writelines(lines)
+        except:
+            try:
+                os.remove(temporary)
+            except OSError as e:
+                print("SD:", e)
+            raise
+
         try:
             os.remove(os.path.join(self.drive, cons.DONE_FILENAME))
         except FileNotFoundError as e:
             print("SD:", e)
-        try:
-            path = os.path.join(sys._MEIPASS, cons.PLUGIN_FILE)
-        except AttributeError:
-            path = cons.PLUGIN_FILE
 
-        shutil.copy(path, os.path.join(self.drive, cons.PLUGIN_FILE))
-        with open(os.path.join(self.drive, cons.SCHEDULE_FILENAME), "w") as file:
-            file.write(txt)
+        report = []
+        size = pluginDigest()[0]
+        if self.hasPlugin():
+            report.append((cons.PLUGIN_FILE, size, False))
+        else:
+            shutil.copy(pluginPath(), os.path.join(self.drive, cons.PLUGIN_FILE))
+            report.append((cons.PLUGIN_FILE, size, True))
+
+        os.replace(temporary, schedule)
+        report.append((cons.SCHEDULE_FILENAME, os.path.getsize(schedule), True))
+        return report
 
     def __repr__(self):
         txt = "%s\tCapacity: %.1fGB, Used: %.1f%%"%(self.drive, self.total, self.percent)
         return txt
 
-def locateUsb():
-    disks = psutil.disk_partitions()
+def isCard(disk):
     if cons.CURRENT_OS == "win32":
-        match = [SD(disk.mountpoint) for disk in disks if ((disk.fstype == 'FAT32') and (disk.opts == 'rw,removable'))]
-    else:
-        match = [SD(disk.mountpoint) for disk in disks if ((disk.fstype == 'vfat') and ('nosuid' in disk.opts ))]
+        return (disk.fstype == 'FAT32') and (disk.opts == 'rw,removable')
+    return (disk.fstype == 'vfat') and ('nosuid' in disk.opts)
+
+def locateUsb(known = {}):
+    """ Returns the SD cards currently mounted.
+    Args:
+        known (dict): SD objects of a previous call, keyed by their partition. Those
+            whose partition has not changed are reused instead of being rebuilt.
+    Returns:
+        dict: SD objects keyed by their partition.
+    """
+    match = {}
+    for disk in psutil.disk_partitions():
+        if isCard(disk):
+            key = (disk.device, disk.mountpoint, disk.fstype, disk.opts)
+            try:
+                match[key] = known[key]
+            except KeyError:
+                match[key] = SD(disk.mountpoint)
     return match
 
+def mountEvents():
+    """ Yields every time the mount table changes.
+
+    On Linux the kernel flags /proc/self/mountinfo with POLLPRI when something is
+    mounted or unmounted, so the thread sleeps until that happens. Elsewhere the
+    mount table is checked every `cons.DRIVES_POLL` seconds.
+
+    The first value is yielded as soon as the watch is in place, without waiting:
+    prime the generator before scanning the drives, so a card mounted during the
+    scan is not missed.
+    """
+    file = None
+    try:
+        file = open(cons.MOUNTINFO, "rb")
+        poller = select.poll()
+        poller.register(file, select.POLLPRI | select.POLLERR)
+    except (OSError, AttributeError):
+        if file != None:
+            file.close()
+        yield
+        while True:
+            sleep(cons.DRIVES_POLL)
+            yield
+    with file:
+        yield
+        while True:
+            poller.poll()
+            yield
+
+class DriveRegistry(object):
+    """ Thread safe registry of the SD cards connected.
+
+    The cards are published as immutable snapshots (tuples), so readers never see a
+    list being rebuilt. Listeners are called from the monitor thread as
+    `listener(snapshot, added, removed, changed)` every time the snapshot changes.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.drives = ()
+        self.listeners = []
+
+    def getDrives(self):
+        return self.drives
+
+    def subscribe(self, listener):
+        with self.lock:
+            self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        with self.lock:
+            try:
+                self.listeners.remove(listener)
+            except ValueError:
+                pass
+
+    def update(self, drives):
+        with self.lock:
+            old = {drive.getDrive(): drive for drive in self.drives}
+            new = {drive.getDrive(): drive for drive in drives}
+            added = tuple(new[path] for path in new if path not in old)
+            removed = tuple(old[path] for path in old if path not in new)
+            changed = tuple(new[path] for path in new if (path in old) and (old[path] is not new[path]))
+            if not (added or removed or changed):
+                return
+            self.drives = tuple(drives)
+            snapshot = self.drives
+            listeners = list(self.listeners)
+        for listener in listeners:
+            try:
+                listener(snapshot, added, removed, changed)
+            except Exception as e:
+                print("DRIVE REGISTRY", e)
+
+registry = DriveRegistry()
+
 def driveMonitor():
+    drives = {}
+    events = mountEvents()
+    next(events)
     while True:
         try:
-            cons.DRIVES = locateUsb()
+            drives = locateUsb(drives)
+            registry.update(drives.values())
         except Exception as e:
             print("DRIVE MONITOR", e)
-        sleep(1)
+        next(events)
 
 thread = Thread(target = driveMonitor)
 thread.setDaemon(True)
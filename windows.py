@@ -1,173 +1,17 @@
 import os
 import sys
 import pickle
-from time import sleep
-from copy import copy
+import threading
+from time import perf_counter
 from datetime import datetime
 from datetime import timedelta
 from PyQt5 import QtCore, QtWidgets, QtGui
-from dateutil.relativedelta import relativedelta
-
-from serial import Serial
-import serial.tools.list_ports as find_ports
 
 import cons
 import usb_lib
-
-def findPorts():
-    ports_objects = list(find_ports.comports())
-    ports = {}
-    for i in range(len(ports_objects)):
-        port = ports_objects[i]
-        try:
-            com = RecorderSerial(port.device)
-            if com.testRecorder():
-                ports["%s"%port.description] = port.device
-            com.close()
-        except Exception as e:
-            print(e)
-    return ports
-
-class RecorderSerial(Serial):
-    def __init__(self, port, baudrate = 9600, timeout = 2):
-        super(RecorderSerial, self).__init__(port, baudrate = baudrate, timeout = timeout)
-        sleep(1)
-
-    def testRecorder(self):
-        line = self.readline()
-        try:
-            line = line.decode()
-            if line == "Connection\r\n":
-                return True
-        except:
-            pass
-        return False
-
-    def decode(self, line):
-        return line.decode().replace("\r\n", "")
-
-    def setTime(self, time):
-        temp = time.strftime("%d%m%y%H%M%S")
-
-        ascii_time = [ord(i) for i in temp]
-        message = [0x00] + ascii_time
-
-        ans = ""
-
-        while True:
-            self.write(message)
-            ans = self.decode(self.readline())
-            try:
-                datetime.strptime(ans, '%d,%m,%y,%H,%M,%S')
-                break
-            except:
-                pass
-
-    def getTime(self):
-        self.write([1])
-        ans = self.readline()
-        ans = self.decode(ans)
-        try:
-            return datetime.strptime(ans, '%d,%m,%y,%H,%M,%S')
-        except:
-            return ans
-
-    def reset(self):
-        self.write([2])
-
-class Event(object):
-    def __init__(self, start, stop, parent = None):
-        self.start = start.replace(second = 0, microsecond = 0)
-        self.stop = stop.replace(second = 0, microsecond = 0)
-        self.parent = parent
-
-    def setStart(self, start):
-        self.start = start
-
-    def setStop(self, stop):
-        self.stop = stop
-
-    def getDate(self):
-        return self.start.date()
-
-    def getStart(self):
-        return self.start
-
-    def getStop(self):
-        return self.stop
-
-    def isChild(self):
-        if self.parent == None:
-            return False
-        else:
-            return True
-
-    def getParent(self):
-        return self.parent
-
-    def save(self):
-        start = self.start.strftime("%d-%m-%y-%H-%M")
-        stop = self.stop.strftime("%d-%m-%y-%H-%M")
-        txt = "%s; %s\n"%(start, stop)
-        return txt
-
-    def viewRepresentation(self):
-        start = self.start.strftime("%Y/%m/%d %H:%M")
-        stop = self.stop.strftime("%Y/%m/%d %H:%M")
-        txt = "%s - %s"%(start, stop)
-        return txt
-
-    def __str__(self):
-        start = self.start.strftime("%H:%M")
-        stop = self.stop.strftime("%H:%M")
-        return "%s - %s"%(start, stop)
-
-class RepeatableEvent(object):
-    def __init__(self, start, stop, until, repeat_every):
-        self.children = []
-        self.until = until
-        self.every = repeat_every
-        self.start = start.replace(second = 0, microsecond = 0)
-        self.stop = stop.replace(second = 0, microsecond = 0)
-
-        self.generateEvents()
-
-    def datesGenerator(self):
-        dates = []
-        current_start = copy(self.start)
-        current_stop = copy(self.stop)
-        hours = 0
-        days = 0
-        weeks = 0
-        months = 0
-        if self.every == "Hour": hours = 1
-        elif self.every == "Day": days = 1
-        elif self.every == "Week": weeks = 1
-        elif self.every == "Month": months = 1
-        while current_stop.date() <= self.until:
-            dates.append((current_start, current_stop))
-            current_start += relativedelta(months = months, weeks = weeks, days = days, hours = hours)
-            current_stop += relativedelta(months = months, weeks = weeks, days = days, hours = hours)
-        return dates
-
-    def generateEvents(self):
-        dates = self.datesGenerator()
-        self.children = [Event(*date, self) for date in dates]
-
-    def getStart(self):
-        return self.start
-
-    def getStop(self):
-        return self.stop
-
-    def getUntil(self):
-        return self.until
-
-    def getRepeat(self):
-        return self.every
-
-    def getChildren(self):
-        return self.children
+import serial_lib
+from serial_lib import findPorts
+from calendar_lib import Event, RepeatableEvent, EventStore, fromMinutes, DAY_MINUTES
 
 class CalWidget(QtWidgets.QDateTimeEdit):
     def __init__(self, parent = None):
@@ -266,6 +110,204 @@ class TimeLabel(QtWidgets.QLabel):
         else:
             return True
 
+class HeatCalendarWidget(QtWidgets.QCalendarWidget):
+    """ Calendar shading every day by the share of it taken by events.
+
+    Each cell reads the day index of the `EventStore` (`EventStore.getDensity`), so
+    painting a month never goes through the events themselves.
+    """
+    def __init__(self, parent = None):
+        super(HeatCalendarWidget, self).__init__(parent)
+        self.store = None
+
+    def setStore(self, store):
+        self.store = store
+        self.updateCells()
+
+    def paintCell(self, painter, rect, date):
+        super(HeatCalendarWidget, self).paintCell(painter, rect, date)
+        if self.store == None:
+            return
+        count, busy = self.store.getDensity(date.toPyDate())
+        if count or busy:
+            color = self.palette().color(QtGui.QPalette.Highlight)
+            color.setAlphaF(0.15 + 0.6 * min(busy / DAY_MINUTES, 1))
+            painter.save()
+            painter.fillRect(rect.adjusted(1, 1, -1, -1), color)
+            if count:
+                font = painter.font()
+                font.setPointSizeF(font.pointSizeF() * 0.7)
+                painter.setFont(font)
+                painter.drawText(rect.adjusted(2, 1, -2, -1), QtCore.Qt.AlignRight | QtCore.Qt.AlignTop, str(count))
+            painter.restore()
+
+class DayModel(QtCore.QAbstractListModel):
+    """ List model of the events of a single day of an `EventStore`.
+
+    The model keeps the (start, stop, series) rows of the day it shows. `refresh`
+    compares them with the store after a change and emits row insertions, removals
+    and data changes only for the rows that differ, so views repaint what changed.
+    """
+    def __init__(self, store, parent = None):
+        super(DayModel, self).__init__(parent)
+        self.store = store
+        self.date = None
+        self.rows = []
+
+    def setStore(self, store):
+        """ Shows the events of `store`, emitting only what differs from the current one. """
+        self.store = store
+        self.refresh()
+
+    def setDate(self, date):
+        self.beginResetModel()
+        self.date = date
+        self.rows = self.dayRows()
+        self.endResetModel()
+
+    def dayRows(self):
+        if self.date == None:
+            return []
+        first, last = self.store.dayRange(self.date)
+        return list(zip(self.store.starts[first:last], self.store.stops[first:last],
+                        self.store.series_ids[first:last]))
+
+    def refresh(self):
+        """ Brings the rows up to date with the store.
+
+        Both the rows shown and the rows stored are ordered by start, so a single merge
+        of the two finds the runs to insert or remove.
+        """
+        new = self.dayRows()
+        pos = 0
+        j = 0
+        while (pos < len(self.rows)) or (j < len(new)):
+            if (j < len(new)) and ((pos == len(self.rows)) or (new[j][0] < self.rows[pos][0])):
+                k = j
+                while (k < len(new)) and ((pos == len(self.rows)) or (new[k][0] < self.rows[pos][0])):
+                    k += 1
+                self.beginInsertRows(QtCore.QModelIndex(), pos, pos + k - j - 1)
+                self.rows[pos:pos] = new[j:k]
+                self.endInsertRows()
+                pos += k - j
+                j = k
+            elif (j == len(new)) or (self.rows[pos][0] < new[j][0]):
+                k = pos
+                while (k < len(self.rows)) and ((j == len(new)) or (self.rows[k][0] < new[j][0])):
+                    k += 1
+                self.beginRemoveRows(QtCore.QModelIndex(), pos, k - 1)
+                del self.rows[pos:k]
+                self.endRemoveRows()
+            else:
+                if self.rows[pos] != new[j]:
+                    self.rows[pos] = new[j]
+                    index = self.index(pos)
+                    self.dataChanged.emit(index, index)
+                pos += 1
+                j += 1
+
+    def getEvent(self, row):
+        return self.store.makeEvent(*self.rows[row])
+
+    def rowCount(self, parent = QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.rows)
+
+    def data(self, index, role = QtCore.Qt.DisplayRole):
+        if index.isValid() and (role == QtCore.Qt.DisplayRole):
+            return str(self.getEvent(index.row()))
+        return None
+
+class EventsModel(QtCore.QAbstractTableModel):
+    """ Table model of the events of an `EventStore` between two dates.
+
+    Rows are not materialised: a row is mapped to a position of the store arrays and
+    only formatted when a view asks for it. Rows are handed to the view a page at a
+    time through `canFetchMore`/`fetchMore`. Since events never overlap, ordering by
+    start or by stop is the order of the store itself; only ordering by duration
+    builds a permutation of positions.
+    """
+    HEADERS = ["Start", "Stop", "Duration"]
+
+    def __init__(self, store, parent = None):
+        super(EventsModel, self).__init__(parent)
+        self.store = store
+        self.first = 0
+        self.last = len(store)
+        self.order = None
+        self.descending = False
+        self.loaded = min(self.last, cons.VIEW_PAGE)
+
+    def setRange(self, begin, end):
+        """ Restricts the rows to the events starting from `begin` up to `end`, both dates, included. """
+        self.beginResetModel()
+        self.first, self.last = self.store.dayRange(begin, end)
+        if self.order != None:
+            self.order = self.durationOrder()
+        self.loaded = min(self.getTotal(), cons.VIEW_PAGE)
+        self.endResetModel()
+
+    def getTotal(self):
+        return self.last - self.first
+
+    def durationOrder(self):
+        starts, stops = self.store.starts, self.store.stops
+        return sorted(range(self.first, self.last), key = lambda i: stops[i] - starts[i],
+                        reverse = self.descending)
+
+    def getPosition(self, row):
+        if self.order != None:
+            return self.order[row]
+        if self.descending:
+            return self.last - 1 - row
+        return self.first + row
+
+    def rowCount(self, parent = QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.loaded
+
+    def columnCount(self, parent = QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.HEADERS)
+
+    def canFetchMore(self, parent = QtCore.QModelIndex()):
+        return (not parent.isValid()) and (self.loaded < self.getTotal())
+
+    def fetchMore(self, parent = QtCore.QModelIndex()):
+        count = min(self.getTotal() - self.loaded, cons.VIEW_PAGE)
+        if count > 0:
+            self.beginInsertRows(QtCore.QModelIndex(), self.loaded, self.loaded + count - 1)
+            self.loaded += count
+            self.endInsertRows()
+
+    def data(self, index, role = QtCore.Qt.DisplayRole):
+        if (not index.isValid()) or (role != QtCore.Qt.DisplayRole):
+            return None
+        i = self.getPosition(index.row())
+        column = index.column()
+        if column == 0:
+            return fromMinutes(self.store.starts[i]).strftime("%Y/%m/%d %H:%M")
+        elif column == 1:
+            return fromMinutes(self.store.stops[i]).strftime("%Y/%m/%d %H:%M")
+        return "%d:%02d"%divmod(self.store.stops[i] - self.store.starts[i], 60)
+
+    def headerData(self, section, orientation, role = QtCore.Qt.DisplayRole):
+        if (orientation == QtCore.Qt.Horizontal) and (role == QtCore.Qt.DisplayRole):
+            return self.HEADERS[section]
+        return super(EventsModel, self).headerData(section, orientation, role)
+
+    def sort(self, column, order = QtCore.Qt.AscendingOrder):
+        self.beginResetModel()
+        self.descending = (order == QtCore.Qt.DescendingOrder)
+        self.order = None
+        if column == 2:
+            self.order = self.durationOrder()
+        self.loaded = min(self.getTotal(), cons.VIEW_PAGE)
+        self.endResetModel()
+
 class ViewDialog(QtWidgets.QDialog):
     def __init__(self, parent):
         super(ViewDialog, self).__init__(parent)
@@ -277,16 +319,78 @@ class ViewDialog(QtWidgets.QDialog):
 
         self.layout.addWidget(QtWidgets.QLabel("These are the following programmed events:"))
 
-        self.list_widget = QtWidgets.QListWidget()
-        self.layout.addWidget(self.list_widget)
-
         events = self.parent.getEvents()
-        keys = sorted(list(events.keys()))
-        items = []
-        for key in keys:
-            day_events = events[key]
-            items += [event.viewRepresentation() for event in day_events]
-        self.list_widget.addItems(items)
+        self.model = EventsModel(events, self)
+
+        self.range_frame = QtWidgets.QFrame()
+        self.range_layout = QtWidgets.QHBoxLayout(self.range_frame)
+        self.range_layout.setContentsMargins(0, 0, 0, 0)
+        self.from_widget = QtWidgets.QDateEdit()
+        self.to_widget = QtWidgets.QDateEdit()
+        for widget in (self.from_widget, self.to_widget):
+            widget.setDisplayFormat("yyyy/MM/dd")
+            widget.setCalendarPopup(True)
+        if len(events):
+            self.from_widget.setDate(fromMinutes(events.starts[0]).date())
+            self.to_widget.setDate(fromMinutes(events.starts[-1]).date())
+        else:
+            self.from_widget.setDate(datetime.now().date())
+            self.to_widget.setDate(datetime.now().date())
+        self.count_label = QtWidgets.QLabel()
+        self.range_layout.addWidget(QtWidgets.QLabel("From:"))
+        self.range_layout.addWidget(self.from_widget)
+        self.range_layout.addWidget(QtWidgets.QLabel("To:"))
+        self.range_layout.addWidget(self.to_widget)
+        self.range_layout.addStretch()
+        self.range_layout.addWidget(self.count_label)
+        self.layout.addWidget(self.range_frame)
+
+        self.table_view = QtWidgets.QTableView()
+        self.table_view.setModel(self.model)
+        self.table_view.setSortingEnabled(True)
+        self.table_view.sortByColumn(0, QtCore.Qt.AscendingOrder)
+        self.table_view.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.table_view.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table_view.verticalHeader().hide()
+        self.table_view.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Stretch)
+        self.layout.addWidget(self.table_view)
+        self.setMinimumSize(QtCore.QSize(450, 400))
+
+        self.from_widget.dateChanged.connect(self.changeRange)
+        self.to_widget.dateChanged.connect(self.changeRange)
+        self.changeRange()
+
+    def changeRange(self):
+        self.model.setRange(self.from_widget.date().toPyDate(), self.to_widget.date().toPyDate())
+        self.count_label.setText("%d events"%self.model.getTotal())
+
+class DriveSignals(QtCore.QObject):
+    """ Bridges the notifications of a `usb_lib.DriveRegistry` into Qt signals.
+
+    The registry notifies from the drive monitor thread; the signals are emitted there
+    and delivered through queued connections to the thread owning the receivers.
+    """
+    added = QtCore.pyqtSignal(object)
+    removed = QtCore.pyqtSignal(object)
+    changed = QtCore.pyqtSignal(object)
+    updated = QtCore.pyqtSignal(object)
+
+    def __init__(self, registry, parent = None):
+        super(DriveSignals, self).__init__(parent)
+        self.registry = registry
+        self.registry.subscribe(self.notify)
+
+    def notify(self, drives, added, removed, changed):
+        for drive in added: self.added.emit(drive)
+        for drive in removed: self.removed.emit(drive)
+        for drive in changed: self.changed.emit(drive)
+        self.updated.emit(drives)
+
+    def getDrives(self):
+        return self.registry.getDrives()
+
+    def close(self):
+        self.registry.unsubscribe(self.notify)
 
 class DrivesDialog(QtWidgets.QDialog):
     def __init__(self, parent):
@@ -305,11 +409,7 @@ class DrivesDialog(QtWidgets.QDialog):
         self.verticalLayout.addWidget(self.frame)
         self.comboBox = QtWidgets.QComboBox()
         self.comboBox.setSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Expanding)
-        self.refresh_button = QtWidgets.QPushButton()
-        self.refresh_button.setText("Refresh")
-        self.refresh_button.clicked.connect(self.refresh)
         self.horizontalLayout.addWidget(self.comboBox)
-        self.horizontalLayout.addWidget(self.refresh_button)
 
         self.label.setText("There are multiple drives connected, pick one:")
         self.label.setSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Expanding)
@@ -323,22 +423,30 @@ class DrivesDialog(QtWidgets.QDialog):
         self.buttons.accepted.connect(self.accept)
         self.buttons.rejected.connect(self.reject2)
 
-        self.drives = cons.DRIVES
-        self.refresh()
+        self.drive_signals = self.parent.getDriveSignals()
+        self.drive_signals.updated.connect(self.refresh, QtCore.Qt.QueuedConnection)
+        self.drives = ()
+        self.refresh(self.drive_signals.getDrives())
 
-    def refresh(self):
-        self.drives = cons.DRIVES
-        current = [str(item) for item in self.drives]
+    def refresh(self, drives):
+        selected = self.getDrive()
+        self.drives = drives
         self.clear()
-        self.comboBox.addItems(current)
+        self.comboBox.addItems([str(item) for item in self.drives])
+        if selected in self.drives:
+            self.comboBox.setCurrentIndex(self.drives.index(selected))
         self.adjustSize()
 
+    def done(self, result):
+        self.drive_signals.updated.disconnect(self.refresh)
+        super(DrivesDialog, self).done(result)
+
     def clear(self):
         self.comboBox.clear()
 
     def reject2(self):
-        self.clear()
         self.reject()
+        self.clear()
 
     def getDrive(self):
         i = self.comboBox.currentIndex()
@@ -347,6 +455,97 @@ class DrivesDialog(QtWidgets.QDialog):
         else:
             return None
 
+class JobSignals(QtCore.QObject):
+    progress = QtCore.pyqtSignal(int, int, str)
+    finished = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(object)
+
+class Job(QtCore.QRunnable):
+    """ Runs `function(job, *args)` on a `QThreadPool`.
+
+    The function reports through `progress` and should poll `isCancelled` between
+    steps. Its return value is emitted by `signals.finished` and any exception by
+    `signals.failed`, both delivered on the thread that created the job.
+    """
+    def __init__(self, function, *args):
+        super(Job, self).__init__()
+        self.setAutoDelete(False)
+        self.function = function
+        self.args = args
+        self.signals = JobSignals()
+        self.cancelled = threading.Event()
+
+    def run(self):
+        try:
+            result = self.function(self, *self.args)
+        except Exception as e:
+            self.signals.failed.emit(e)
+        else:
+            self.signals.finished.emit(result)
+
+    def progress(self, done, total, text = ""):
+        self.signals.progress.emit(done, total, text)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def isCancelled(self):
+        return self.cancelled.is_set()
+
+def saveRules(rules, file_name):
+    """ Writes the rules of a calendar (`EventStore.getRules`) as a .tfc file. """
+    with open(file_name, 'wb') as file:
+        pickle.dump(rules, file)
+
+def syncJob(job, ports, precise):
+    if ports == None:
+        job.progress(0, 0, "Looking for recorders...")
+        ports = findPorts()
+    if len(ports) == 0:
+        raise Exception("There is no device connected.")
+    if job.isCancelled():
+        raise InterruptedError("Synchronization cancelled.")
+    done = []
+    def progress(result):
+        done.append(result)
+        job.progress(len(done), len(ports), str(result))
+    job.progress(0, len(ports), "Synchronizing %d recorder(s)..."%len(ports))
+    return serial_lib.synchronize(ports, precise, progress = progress, cancelled = job.isCancelled)
+
+def surveyJob(job):
+    job.progress(0, 0, "Looking for recorders...")
+    ports = findPorts()
+    if len(ports) == 0:
+        raise Exception("There is no device connected.")
+    if job.isCancelled():
+        raise InterruptedError("Survey cancelled.")
+    done = []
+    def progress(result):
+        done.append(result)
+        job.progress(len(done), len(ports), str(result))
+    job.progress(0, len(ports), "Reading %d recorder(s)..."%len(ports))
+    return serial_lib.survey(ports, progress = progress, cancelled = job.isCancelled)
+
+def exportJob(job, drive, events, rules):
+    """ Writes `events`, a snapshot of the calendar, on `drive` and saves `rules` next to it.
+    Returns:
+        tuple: the drive, the `SD.save` report and the seconds it took.
+    """
+    total = len(events)
+    def lines(size = 4096):
+        done = 0
+        for chunk in events.iterLines(size):
+            if job.isCancelled():
+                raise InterruptedError("Export cancelled, the schedule on %s was left unchanged."%drive.getDrive())
+            yield chunk
+            done = min(done + size, total)
+            job.progress(done, total, "Writing schedule on %s..."%drive.getDrive())
+    start = perf_counter()
+    report = drive.save(lines())
+    elapsed = max(perf_counter() - start, 1e-6)
+    saveRules(rules, os.path.join(drive.getDrive(), cons.SAVE_FILENAME))
+    return drive, report, elapsed
+
 class CalendarWindow(QtWidgets.QMainWindow):
     def __init__(self, parent = None):
         super(QtWidgets.QMainWindow, self).__init__(parent)
@@ -364,8 +563,8 @@ class CalendarWindow(QtWidgets.QMainWindow):
         openAction = QtWidgets.QAction("Open", self)
         openAction.setShortcut("Ctrl+O")
 
-        exportAction = QtWidgets.QAction("Export", self)
-        exportAction.setShortcut("Ctrl+E")
+        self.export_action = QtWidgets.QAction("Export", self)
+        self.export_action.setShortcut("Ctrl+E")
 
         quitAction = QtWidgets.QAction("Quit", self)
         quitAction.setShortcut("Ctrl+Q")
@@ -373,10 +572,23 @@ class CalendarWindow(QtWidgets.QMainWindow):
         fileMenu.addAction(saveAction)
         fileMenu.addAction(openAction)
         fileMenu.addSeparator()
-        fileMenu.addAction(exportAction)
+        fileMenu.addAction(self.export_action)
         fileMenu.addSeparator()
         fileMenu.addAction(quitAction)
 
+        clockMenu = mainMenu.addMenu('&Clock')
+
+        self.sync_action = QtWidgets.QAction("Synchronize", self)
+        self.precise_action = QtWidgets.QAction("Precise synchronization", self)
+        self.precise_action.setCheckable(True)
+
+        self.drift_action = QtWidgets.QAction("Drift survey", self)
+
+        clockMenu.addAction(self.sync_action)
+        clockMenu.addAction(self.precise_action)
+        clockMenu.addSeparator()
+        clockMenu.addAction(self.drift_action)
+
         self.verticalLayout = QtWidgets.QVBoxLayout(wid)
         self.verticalLayout.setContentsMargins(11, 11, 11, 11)
         self.verticalLayout.setSpacing(6)
@@ -389,7 +601,7 @@ class CalendarWindow(QtWidgets.QMainWindow):
 
         self.calendar_group = QtWidgets.QGroupBox("Calendar:")
         self.calendar_layout = QtWidgets.QHBoxLayout(self.calendar_group)
-        self.calendar_widget = QtWidgets.QCalendarWidget()
+        self.calendar_widget = HeatCalendarWidget()
         self.calendar_widget.setMinimumDate(datetime.now().date())
         self.calendar_widget.setVerticalHeaderFormat(0)
 
@@ -397,7 +609,9 @@ class CalendarWindow(QtWidgets.QMainWindow):
         self.event_layout = QtWidgets.QVBoxLayout(self.event_group)
         self.event_date = QtWidgets.QLabel("")
         self.event_date.setAlignment(QtCore.Qt.AlignCenter)
-        self.event_list = QtWidgets.QListWidget()
+        self.event_list = QtWidgets.QListView()
+        self.event_list.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.event_list.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
         self.button_frame = QtWidgets.QFrame()
         self.button_frame_layout = QtWidgets.QHBoxLayout(self.button_frame)
         self.times_group = QtWidgets.QGroupBox("Event start/stop:")
@@ -453,7 +667,12 @@ class CalendarWindow(QtWidgets.QMainWindow):
         self.verticalLayout.addWidget(self.button_frame)
 
         self.current_date = datetime.today()
-        self.events = {}
+        self.events = EventStore()
+        self.day_model = DayModel(self.events, self)
+        self.calendar_widget.setStore(self.events)
+        self.event_list.setModel(self.day_model)
+        self.jobs = []
+        self.drive_signals = DriveSignals(usb_lib.registry, self)
         self.is_editting = False
 
         self.times_group.setEnabled(False)
@@ -464,12 +683,14 @@ class CalendarWindow(QtWidgets.QMainWindow):
         #####
         saveAction.triggered.connect(self.saveHandler)
         openAction.triggered.connect(self.openHandler)
-        exportAction.triggered.connect(self.exportHandler)
+        self.export_action.triggered.connect(self.exportHandler)
         quitAction.triggered.connect(self.close)
+        self.sync_action.triggered.connect(self.syncHandler)
+        self.drift_action.triggered.connect(self.driftHandler)
 
         self.calendar_widget.selectionChanged.connect(self.changeDate)
-        self.event_list.itemSelectionChanged.connect(self.changeTimes)
-        self.event_list.itemDoubleClicked.connect(self.selectHandler)
+        self.event_list.selectionModel().selectionChanged.connect(self.changeTimes)
+        self.event_list.doubleClicked.connect(self.selectHandler)
         self.add_button.clicked.connect(self.addHandler)
         self.remove_button.clicked.connect(self.removeHandler)
         self.from_time_widget.dateTimeChanged.connect(self.fromDateTimeChanged)
@@ -486,6 +707,9 @@ class CalendarWindow(QtWidgets.QMainWindow):
     def getEvents(self):
         return self.events
 
+    def getDriveSignals(self):
+        return self.drive_signals
+
     def centerOnScreen(self):
         frameGm = self.frameGeometry()
         screen = QtWidgets.QApplication.desktop().screenNumber(QtWidgets.QApplication.desktop().cursor().pos())
@@ -532,16 +756,26 @@ class CalendarWindow(QtWidgets.QMainWindow):
         return date.strftime("%Y/%m/%d")
 
     def saveEvent(self, event):
-        txt = self.formatDate(event.getDate())
-        try:
-            for item in self.events[txt]:
-                if ((item.getStart() <= event.getStop()) and (item.getStop() >= event.getStart())):
-                    date = item.getDate().strftime("%Y/%m/%d")
-                    raise(SystemError("The following times overlap: (%s) and (%s) on %s."%(item, event, date)))
-            self.events[txt].append(event)
-            self.events[txt] = sorted(self.events[txt], key = str)
-        except KeyError:
-            self.events[txt] = [event]
+        item = self.events.overlap(event.getStart(), event.getStop())
+        if item != None:
+            date = item.getDate().strftime("%Y/%m/%d")
+            raise(SystemError("The following times overlap: (%s) and (%s) on %s."%(item, event, date)))
+        self.events.add(event)
+
+    def eventsChanged(self):
+        self.day_model.setStore(self.events)
+        self.calendar_widget.setStore(self.events)
+
+    def getSelectedRow(self):
+        rows = self.event_list.selectionModel().selectedRows()
+        if len(rows):
+            return rows[0].row()
+        return None
+
+    def popEvent(self, pos):
+        evt = self.day_model.getEvent(pos)
+        self.events.remove(evt)
+        return evt
 
     def addHandler(self):
         txt = self.add_button.text()
@@ -550,16 +784,17 @@ class CalendarWindow(QtWidgets.QMainWindow):
             self.add_button.setText("Save")
             self.is_editting = True
         elif txt == "Save":
-            old_events = copy(self.events)
+            pos = self.getSelectedRow()
+            if self.is_editting and (pos == None):
+                self.selectHandler()
+                return
+            old_events = self.events.copy()
             if self.is_editting:
-                pos = self.event_list.currentRow()
-                evt = self.events[self.formatDate(self.current_date)][pos]
+                evt = self.day_model.getEvent(pos)
                 if self.repeat_widget.isChecked() and evt.isChild():
                     self.removeMultipleDates(evt)
                 else:
-                    evt = self.events[self.formatDate(self.current_date)].pop(pos)
-                    if evt.isChild():
-                        evt.getParent().getChildren().remove(evt)
+                    self.popEvent(pos)
             try:
                 if self.repeat_widget.isChecked():
                     every = self.every_widget.currentText()
@@ -568,8 +803,7 @@ class CalendarWindow(QtWidgets.QMainWindow):
                     until = self.to_repeat_widget.date().toPyDate()
 
                     r_event = RepeatableEvent(start, stop, until, every)
-                    for event in r_event.getChildren():
-                        self.saveEvent(event)
+                    self.events.addSeries(r_event)
                 else:
                     event = Event(self.from_time_widget.dateTime().toPyDateTime(),
                                         self.to_time_widget.dateTime().toPyDateTime())
@@ -578,7 +812,7 @@ class CalendarWindow(QtWidgets.QMainWindow):
             except SystemError as e:
                 self.errorWindow(e)
                 self.events = old_events
-            self.changeDate()
+            self.eventsChanged()
             self.times_group.setEnabled(False)
             self.add_button.setText("Add")
             self.remove_button.setEnabled(False)
@@ -592,17 +826,13 @@ class CalendarWindow(QtWidgets.QMainWindow):
             self.setDateTimeWidgets()
 
     def removeMultipleDates(self, event):
-        for child in event.getParent().getChildren():
-            date_txt = self.formatDate(child.getDate())
-            try:
-                self.events[date_txt].remove(child)
-            except KeyError:
-                pass
-        event.getParent().children = []
+        self.events.removeSeries(event.getParent())
 
     def removeHandler(self):
-        pos = self.event_list.currentRow()
-        event = self.events[self.formatDate(self.current_date)][pos]
+        pos = self.getSelectedRow()
+        if pos == None:
+            return
+        event = self.day_model.getEvent(pos)
         if event.isChild():
             msg = "There are multiple events associated.\nDo you want to remove all?"
             reply = QtWidgets.QMessageBox.warning(self, 'Remove',
@@ -612,34 +842,25 @@ class CalendarWindow(QtWidgets.QMainWindow):
                 if reply == QtWidgets.QMessageBox.Yes:
                     self.removeMultipleDates(event)
                 else:
-                    evt = self.events[self.formatDate(self.current_date)].pop(pos)
-                    evt.getParent().getChildren().remove(evt)
-                self.addItems(self.events[self.formatDate(self.current_date)])
+                    self.popEvent(pos)
+                self.eventsChanged()
                 self.selectHandler()
         else:
             msg = "Are you sure you want to remove this event?"
             reply = QtWidgets.QMessageBox.warning(self, 'Remove',
                              msg, QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No)
             if reply == QtWidgets.QMessageBox.Yes:
-                self.events[self.formatDate(self.current_date)].pop(pos)
-                self.addItems(self.events[self.formatDate(self.current_date)])
+                self.popEvent(pos)
+                self.eventsChanged()
                 self.selectHandler()
 
-    def addItems(self, events):
-        self.event_list.blockSignals(True)
-        self.event_list.clear()
-        self.event_list.addItems([str(event) for event in events])
-        self.event_list.blockSignals(False)
-
     def selectHandler(self):
         # self.timesEnabled(False)
         self.times_group.setEnabled(False)
         self.repeat_widget.setChecked(False)
         self.add_button.setText("Add")
         self.remove_button.setEnabled(False)
-        self.event_list.blockSignals(True)
         self.event_list.clearSelection()
-        self.event_list.blockSignals(False)
         self.is_editting = False
 
     def repeatHandler(self, state):
@@ -651,13 +872,7 @@ class CalendarWindow(QtWidgets.QMainWindow):
         self.current_date = self.calendar_widget.selectedDate().toPyDate()
         txt = self.formatDate(self.current_date)
         self.event_date.setText(txt)
-        try:
-            self.addItems(self.events[txt])
-        except KeyError:
-            self.event_list.blockSignals(True)
-            self.event_list.clear()
-            self.event_list.clearSelection()
-            self.event_list.blockSignals(False)
+        self.day_model.setDate(self.current_date)
 
         self.times_group.setEnabled(False)
         self.add_button.setText("Add")
@@ -667,12 +882,12 @@ class CalendarWindow(QtWidgets.QMainWindow):
         self.repeat_widget.setChecked(False)
 
     def changeTimes(self):
-        pos = self.event_list.currentRow()
-        try:
-            evt = self.events[self.formatDate(self.current_date)][pos]
-            self.setDateTimeWidgets(evt)
-        except IndexError:
-            self.setDateTimeWidgets()
+        pos = self.getSelectedRow()
+        if pos == None:
+            if self.is_editting or (self.add_button.text() == "Edit"):
+                self.selectHandler()
+            return
+        self.setDateTimeWidgets(self.day_model.getEvent(pos))
         self.add_button.setText("Edit")
         self.times_group.setEnabled(False)
         self.remove_button.setEnabled(True)
@@ -684,8 +899,7 @@ class CalendarWindow(QtWidgets.QMainWindow):
         self.to_time_widget.setMinimumDateTime(date)
 
     def save(self, file_name):
-        with open(file_name, 'wb') as file:
-            pickle.dump(self.events, file)
+        saveRules(self.events.getRules(), file_name)
 
     def saveHandler(self):
         file_name = QtWidgets.QFileDialog.getSaveFileName(self, 'Save Calendar', filter = "*%s"%cons.FC_EXTENSION)
@@ -699,67 +913,181 @@ class CalendarWindow(QtWidgets.QMainWindow):
         if file_name[0]:
             name = file_name[0].replace(cons.FC_EXTENSION, "")
             file_name = name + file_name[1][1:]
-            with open(file_name, 'rb') as file:
-                self.events = pickle.load(file)
+            dropped = []
+            try:
+                with open(file_name, 'rb') as file:
+                    events = EventStore.load(pickle.load(file), dropped)
+            except SystemError as e:
+                self.errorWindow(e)
+            else:
+                self.events = events
+                self.eventsChanged()
+                if len(dropped):
+                    msg = "%d overlapping event(s) could not be loaded:\n"%len(dropped)
+                    msg += "\n".join(event.viewRepresentation() for event in dropped[:10])
+                    if len(dropped) > 10:
+                        msg += "\n..."
+                    self.errorWindow(Exception(msg))
         self.changeDate()
 
     def viewHandler(self):
         ViewDialog(self).show()
 
-    def syncHandler(self):
-        ports = findPorts()
-        if len(ports):
-            try:
-                for port in ports:
-                    port = ports[port]
-                    serial = RecorderSerial(port = port, timeout = 2)
-                    serial.setTime(datetime.now())
-                    serial.reset()
-                    try: serial.close()
-                    except: pass
-
-                msg = "Clock has been synchronized."
-                if len(ports) > 1: msg = "Clocks have been synchronized."
-                QtWidgets.QMessageBox.information(self, 'Successful synchronization',
-                                        msg , QtWidgets.QMessageBox.Ok)
-            except Exception as e:
-                self.errorWindow(e)
+    def startJob(self, job, title, finished):
+        """ Runs `job` on the thread pool behind a progress dialog that can cancel it.
+        `finished` is called with the job result on the GUI thread, errors are shown.
+        """
+        dialog = QtWidgets.QProgressDialog(title, "Cancel", 0, 0, self)
+        dialog.setWindowTitle(title)
+        dialog.setMinimumDuration(0)
+        dialog.setAutoClose(False)
+        dialog.setAutoReset(False)
+        dialog.canceled.connect(job.cancel)
+
+        def progress(done, total, text):
+            if dialog.wasCanceled():
+                return
+            dialog.setMaximum(total)
+            dialog.setValue(done)
+            if text: dialog.setLabelText(text)
+
+        def end():
+            dialog.canceled.disconnect(job.cancel)
+            dialog.close()
+            dialog.deleteLater()
+            self.jobs.remove(job)
+            self.setBusy(len(self.jobs) > 0)
+
+        def done(result):
+            end()
+            finished(result)
+
+        def failed(exception):
+            end()
+            self.errorWindow(exception)
+
+        job.signals.progress.connect(progress)
+        job.signals.finished.connect(done)
+        job.signals.failed.connect(failed)
+        self.jobs.append(job)
+        self.setBusy(True)
+        dialog.show()
+        QtCore.QThreadPool.globalInstance().start(job)
+
+    def setBusy(self, busy):
+        for widget in (self.sync_widget, self.export_widget, self.sync_action,
+                        self.drift_action, self.export_action):
+            widget.setEnabled(not busy)
+
+    def isBusy(self):
+        return len(self.jobs) > 0
 
+    def syncHandler(self):
+        self.synchronizePorts(None)
+
+    def synchronizePorts(self, ports, precise = None):
+        if self.isBusy(): return
+        if precise == None:
+            precise = self.precise_action.isChecked()
+        self.startJob(Job(syncJob, ports, precise), "Synchronizing", self.syncFinished)
+
+    def syncFinished(self, results):
+        keys = serial_lib.deviceKeys()
+        for result in results:
+            if result.isSuccessful():
+                serial_lib.drift_log.reset(keys.get(result.device, result.device), result.name, result.offset)
+            elif not isinstance(result.error, InterruptedError):
+                serial_lib.cache.forget(result.device)
+        serial_lib.drift_log.save()
+        failed = [result for result in results if not result.isSuccessful()]
+        if len(failed) == len(results):
+            self.errorWindow(Exception("\n".join(str(result) for result in failed)))
+        else:
+            msg = "Clock has been synchronized."
+            if len(results) > 1: msg = "Clocks have been synchronized."
+            msg += "\n\n" + "\n".join(str(result) for result in results)
+            msg += "\n\nResidual skew: %.3f s"%serial_lib.getSkew(results)
+            QtWidgets.QMessageBox.information(self, 'Successful synchronization',
+                                    msg , QtWidgets.QMessageBox.Ok)
+
+    def driftHandler(self):
+        if self.isBusy(): return
+        self.startJob(Job(surveyJob), "Drift survey", self.driftFinished)
+
+    def driftFinished(self, results):
+        keys = serial_lib.deviceKeys()
+        log = serial_lib.drift_log
+        lines = []
+        drifted = {}
+        for result in results:
+            if not result.isSuccessful():
+                lines.append(str(result))
+                continue
+            key = keys.get(result.device, result.device)
+            log.add(key, result.name, result.offset)
+            txt = "%s: offset %+.3f s"%(result.name, result.offset)
+            drift = log.getDrift(key)
+            if drift != None:
+                txt += ", drift %+.1f ppm"%drift
+            lines.append(txt)
+            if log.needsSync(key):
+                drifted[result.device] = result.name
+        log.save()
+
+        msg = "\n".join(lines)
+        if len(drifted):
+            msg += "\n\n%d recorder(s) drifted more than %.1f s.\nDo you want to synchronize them?"%(len(drifted), cons.DRIFT_THRESHOLD)
+            reply = QtWidgets.QMessageBox.question(self, 'Drift survey',
+                             msg, QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No)
+            if reply == QtWidgets.QMessageBox.Yes:
+                self.synchronizePorts(drifted, precise = True)
         else:
-            self.errorWindow(Exception("There is no device connected."))
+            QtWidgets.QMessageBox.information(self, 'Drift survey',
+                                    msg, QtWidgets.QMessageBox.Ok)
 
     def exportHandler(self):
+        if self.isBusy(): return
         if self.add_button.text() == "Save":
             self.addHandler()
-        keys = sorted(list(self.events.keys()))
-        lines = [event.save() for key in keys for event in self.events[key]]
-        if len(lines) == 0:
+        if len(self.events) == 0:
             self.errorWindow(Exception("Calendar is empty."))
         else:
-            lines = "".join(lines)
-            if len(cons.DRIVES):
-                if len(cons.DRIVES) > 1:
+            drives = self.drive_signals.getDrives()
+            if len(drives):
+                if len(drives) > 1:
                     dialog = DrivesDialog(self)
                     dialog.exec_()
                     drive = dialog.getDrive()
                 else:
-                    drive = cons.DRIVES[0]
+                    drive = drives[0]
                 if drive != None:
-                    try:
-                        drive.save(lines)
-                        self.save(os.path.join(drive.getDrive(), cons.SAVE_FILENAME))
-                        QtWidgets.QMessageBox.information(self, 'File has been saved',
-                                                 "Schedule has been saved on: %s"%(drive.getDrive()), QtWidgets.QMessageBox.Ok)
-                    except Exception as e:
-                        self.errorWindow(e)
+                    job = Job(exportJob, drive, self.events.copy(), self.events.getRules())
+                    self.startJob(job, "Exporting", self.exportFinished)
             else:
                 self.errorWindow(Exception("There is no compatible SD card connected."))
 
+    def exportFinished(self, result):
+        drive, report, elapsed = result
+        msg = "Schedule has been saved on: %s\n"%drive.getDrive()
+        size = 0
+        for name, file_size, written in report:
+            if written:
+                size += file_size
+                msg += "\n%s: %d bytes written."%(name, file_size)
+            else:
+                msg += "\n%s: skipped, already up to date."%name
+        msg += "\n\n%d bytes written (%.1f kB/s)."%(size, size / elapsed / 1024)
+        QtWidgets.QMessageBox.information(self, 'File has been saved',
+                                 msg, QtWidgets.QMessageBox.Ok)
+
     def closeEvent(self, event):
         quit_msg = "Are you sure you want to exit the program?"
         reply = QtWidgets.QMessageBox.question(self, 'Exit',
                          quit_msg, QtWidgets.QMessageBox.Yes, QtWidgets.QMessageBox.No)
         if reply == QtWidgets.QMessageBox.Yes:
+            for job in self.jobs:
+                job.cancel()
+            self.drive_signals.close()
             event.accept()
         else:
             event.ignore()